@@ -231,8 +231,10 @@ class LLVMAnalyzer(idawasm.analysis.Analyzer):
         returns:
           dict[int, list[FrameReference]]: mapping from frame_offset to set of frame references
         """
-        buf = ida_bytes.get_bytes(function['offset'], function['size'])
-        bc = list(wasm.decode.decode_bytecode(buf))
+        bc = self.proc.decoded_bodies.get(function['offset'])
+        if bc is None:
+            buf = ida_bytes.get_bytes(function['offset'], function['size'])
+            bc = list(wasm.decode.decode_bytecode(buf))
 
         offset = function['offset']
         SLICE_SIZE = 3
@@ -0,0 +1,169 @@
+# coding: utf-8
+"""
+command line installer that copies the idawasm loader and processor plugins into an IDA installation.
+"""
+
+import os
+
+from idawasm import __version__
+
+# plugin scripts installed into IDA, resolved relative to the package directory.
+_PKG_DIR = os.path.dirname(os.path.abspath(__file__))
+_LOADER_SRC = os.path.join(os.path.dirname(_PKG_DIR), 'loaders', 'wasm_loader.py')
+_PROC_SRC = os.path.join(os.path.dirname(_PKG_DIR), 'procs', 'wasm_proc.py')
+
+
+class ExitException(Exception):
+    pass
+
+
+def _needs_copy(src, dst_dir):
+    """
+    does `src` need to be (re)copied into `dst_dir`?
+    an existing destination of the same size that is not older than the source is considered up to date.
+    """
+    try:
+        ss = os.stat(src)
+        ds = os.stat(os.path.join(dst_dir, os.path.basename(src)))
+    except FileNotFoundError:
+        return True
+    return not (ss.st_size == ds.st_size and ss.st_mtime_ns <= ds.st_mtime_ns)
+
+
+def _find_ida_plugin_dirs(ida_root):
+    """
+    validate the IDA root folder, and return the paths of its loaders and procs directories.
+    """
+    import stat
+
+    try:
+        st = ida_root.stat()
+    except FileNotFoundError:
+        print('[Error] Path provided does not exist: {}'.format(ida_root))
+        raise ExitException()
+    except OSError as e:
+        print('[Error] Path provided could not be accessed: {}'.format(e))
+        raise ExitException()
+
+    if not stat.S_ISDIR(st.st_mode):
+        print('[Error] Path provided is not a directory.')
+        raise ExitException()
+
+    #   Verify the IDA layout with a single directory listing
+    with os.scandir(ida_root) as it:
+        entries = {entry.name: entry for entry in it}
+    if not all(name in entries and entries[name].is_dir() for name in ('loaders', 'procs')):
+        print('[Error] No IDA in folder: {}'.format(ida_root))
+        raise ExitException()
+
+    return entries['loaders'].path, entries['procs'].path
+
+
+def _copy_mac_dependencies(ida_root):
+    """
+    copy the `requests` package into IDA's python folder, which IDA on Mac needs.
+    """
+    import importlib.util
+    import shutil
+
+    #   Locate the `requests` package without importing it (and its dependencies)
+    spec = importlib.util.find_spec('requests')
+    if spec is None or not spec.submodule_search_locations:
+        print('[Error] The `requests` package is not installed.')
+        raise ExitException()
+    requests_path = spec.submodule_search_locations[0]
+
+    #   Copy requests to IDA's python folder
+    print('- Copying FIRST dependencies to IDA\'s python folder...')
+    try:
+        shutil.copytree(requests_path, ida_root / 'python' / 'requests',
+                        copy_function=shutil.copy2, dirs_exist_ok=True)
+    except (shutil.Error, OSError) as e:
+        print('[Error] Failed to copy dependencies: {}'.format(e))
+        raise ExitException()
+
+
+def _install_plugins(plugins):
+    """
+    copy each (kind, source path, destination directory) plugin that is missing or out of date into IDA.
+    """
+    import concurrent.futures
+    import shutil
+
+    #   Use a larger buffer when shutil falls back to read/write copies (e.g. Windows)
+    if hasattr(shutil, 'COPY_BUFSIZE'):
+        shutil.COPY_BUFSIZE = 1 << 20
+
+    msg = '\nCopy {} to IDA...\n'\
+          '- from: {}\n'\
+          '- to: {}\n'
+    up_to_date_msg = '\n* The IDA {} is already up to date:  {}\n'
+    stale = []
+    for kind, src, dst in plugins:
+        if _needs_copy(src, dst):
+            print(msg.format(os.path.basename(src), os.path.dirname(src), dst))
+            stale.append((kind, src, dst))
+        else:
+            print(up_to_date_msg.format(kind, os.path.basename(src)))
+
+    #   The copies are independent, so overlap them.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        copies = [executor.submit(shutil.copy, src, dst) for _, src, dst in stale]
+        for copy in copies:
+            copy.result()
+
+    msg = '* An IDA {} has been installed:  {}\n'
+    for kind, src, _ in stale:
+        print(msg.format(kind, os.path.basename(src)))
+
+
+def main():
+    usage = 'Description: An IDA Pro plugin that implements the loader and processor ' \
+        'to disassembly the WebAssembly Binary (.wasm) files.\n'\
+        'Version: {}\n'\
+        'Requirements: \n'\
+        '- IDA Pro 7.4+ and Python 3.8+\n'\
+        '- Admin Privileges\n'\
+        '  (usually needed to copy plugin into IDA directory)\n\n'
+    print(usage.format(__version__))
+
+    # installer-only dependencies, imported on demand.
+    import pathlib
+    import platform
+
+    os_name = os.name
+    system = platform.system()
+
+    try:
+        default_path = os.getcwd()
+        try:
+            ida_root_path = input(f'Enter full path to IDA\'s root folder [{default_path}]: ').strip() or default_path
+        except (KeyboardInterrupt, EOFError):
+            return
+        ida_root = pathlib.Path(ida_root_path)
+        ida_loaders_path, ida_procs_path = _find_ida_plugin_dirs(ida_root)
+
+        if (os_name == 'posix') and (system == 'Darwin'):
+            #   Install for Mac
+            _copy_mac_dependencies(ida_root)
+        elif (os_name == 'nt') and (system == 'Windows'):
+            #   Install for Windows - no additional steps required
+            pass
+        elif (os_name == 'posix') and (system == 'Linux'):
+            #   Currently not supported due to having no ida to bring in the dependencies for Linux
+            print('- Unfortunately the current OS is not supported.')
+            raise ExitException()
+        else:
+            #   Doesn't support other systems
+            print('- Unfortunately the current OS is not supported.')
+            raise ExitException()
+
+        #   Copy plugin to IDA's loaders directory
+        _install_plugins((('loader', _LOADER_SRC, ida_loaders_path),
+                          ('processor', _PROC_SRC, ida_procs_path)))
+
+    except ExitException:
+        pass
+
+    finally:
+        print('\n...exiting...')
@@ -4,18 +4,30 @@ from typing import Any, NamedTuple, Union
 from wasm.types import StructureData
 
 
+# keys under which computed layout is cached in a struct's decoder meta.
+# the decoder meta dict lives exactly as long as the struct, so the cache can't go stale.
+_OFFSETS_KEY = 'idawasm.offsets'
+_SIZE_KEY = 'idawasm.size'
+
+
 def offset_of(struc: StructureData, fieldname: str) -> int:
     """
     given a wasm struct instance and a field name, return the offset into the struct where you'd find the field.
     """
-    p = 0
     dec_meta = struc.get_decoder_meta()
-    for field in struc.get_meta().fields:
-        if field.name != fieldname:
+    offsets = dec_meta.get(_OFFSETS_KEY)
+    if offsets is None:
+        offsets = {}
+        p = 0
+        for field in struc.get_meta().fields:
+            offsets[field.name] = p
             p += dec_meta['lengths'][field.name]
-        else:
-            return p
-    raise KeyError('field not found: ' + fieldname)
+        dec_meta[_OFFSETS_KEY] = offsets
+
+    try:
+        return offsets[fieldname]
+    except KeyError:
+        raise KeyError('field not found: ' + fieldname)
 
 
 def size_of(struc: StructureData, fieldname: str = None) -> int:
@@ -24,13 +36,16 @@ def size_of(struc: StructureData, fieldname: str = None) -> int:
     if a field name is provided, fetch the size of the given field.
     otherwise, fetch the size of the entire struct.
     """
+    dec_meta = struc.get_decoder_meta()
     if fieldname is not None:
         # size of the given field, by name
-        dec_meta = struc.get_decoder_meta()
         return dec_meta['lengths'][fieldname]
     else:
         # size of the entire given struct
-        return sum(struc.get_decoder_meta()['lengths'].values())
+        size = dec_meta.get(_SIZE_KEY)
+        if size is None:
+            size = dec_meta[_SIZE_KEY] = sum(dec_meta['lengths'].values())
+        return size
 
 
 class Field(NamedTuple):
@@ -73,6 +88,14 @@ def is_struc(o: Any) -> bool:
     return '.GeneratedStructureData' in str(type(o))
 
 
+def decode_str(buf: memoryview) -> str:
+    """
+    decode a UTF-8 string, such as an import or export name, from the given buffer.
+    decodes directly from the buffer, without first copying it into a `bytes`.
+    """
+    return str(buf, 'utf-8')
+
+
 def struc_to_dict(struc: Any) -> Any:
     if isinstance(struc, str):
         return struc
@@ -85,6 +108,6 @@ def struc_to_dict(struc: Any) -> Any:
     elif is_struc(struc):
         return {f.name: struc_to_dict(f.value) for f in get_fields(struc)}
     elif isinstance(struc, memoryview):
-        return struc.tobytes().decode('utf-8')
+        return decode_str(struc)
     else:
         raise ValueError('unexpected type: ' + str(type(struc)))
@@ -15,7 +15,7 @@ from wasm.decode import ModuleFragment
 from wasm.types import StructureData
 
 import idawasm.const
-from idawasm.common import get_fields, is_struc, offset_of, size_of
+from idawasm.common import decode_str, get_fields, is_struc, offset_of, size_of
 
 
 def accept_file(f: ida_idaapi.loader_input_t, n: Any) -> Union[str, int]:
@@ -105,7 +105,7 @@ def format_value(name: str, value: Any) -> str:
         return '[' + ', '.join([format_value(name, v) for v in value]) + ']'
     elif isinstance(value, memoryview) and 'str' in name:
         try:
-            return value.tobytes().decode('utf-8')
+            return decode_str(value)
         except UnicodeDecodeError:
             return ''
     else:
@@ -266,7 +266,7 @@ def load_file(f: ida_idaapi.loader_input_t, neflags: Any, format: Any) -> int:
         else:
             if section.data.id == wasm.wasmtypes.SEC_UNK:
                 if section.data.name:
-                    sname = section.data.name.tobytes().decode('utf-8')
+                    sname = decode_str(section.data.name)
                 else:
                     sname = ''
             else:
@@ -1,6 +1,8 @@
+import array
+import bisect
 import functools
+import itertools
 import logging
-from collections import deque
 from typing import Any, Optional
 
 import ida_bytes
@@ -19,7 +21,7 @@ from wasm.decode import Instruction, ModuleFragment
 
 import idawasm.analysis.llvm
 import idawasm.const
-from idawasm.common import offset_of, size_of, struc_to_dict
+from idawasm.common import decode_str, offset_of, size_of, struc_to_dict
 from idawasm.types import Block, Data, Function, Global
 
 logger = logging.getLogger(__name__)
@@ -34,6 +36,54 @@ WASM_ALIGN = ida_ua.o_idpspec5
 WASM_BRANCH_TABLE = ida_ua.o_idpspec5+1
 WASM_BRANCH_TABLE_DEFAULT = ida_ua.o_idpspec5+2
 
+# map from operand data type (dt_xxx) to output width flag (OOFW_xxx)
+DT_WIDTHS = {
+    ida_ua.dt_byte: ida_ua.OOFW_8,
+    ida_ua.dt_word: ida_ua.OOFW_16,
+    ida_ua.dt_dword: ida_ua.OOFW_32,
+    ida_ua.dt_qword: ida_ua.OOFW_64,
+    ida_ua.dt_float: ida_ua.OOFW_32,
+    ida_ua.dt_double: ida_ua.OOFW_64,
+}
+
+# map from block-opening opcode to the type of block it opens.
+BLOCK_TYPES = {
+    wasm.OP_BLOCK: 'block',
+    wasm.OP_LOOP: 'loop',
+    wasm.OP_IF: 'if',
+}
+
+# opcodes that branch to an enclosing block, given a relative depth.
+BRANCH_OPS = frozenset({wasm.OP_BR, wasm.OP_BR_IF})
+
+# opcodes that affect block structure or branch targets.
+# all other instructions are skipped over when computing branch targets.
+CONTROL_OPS = frozenset(BLOCK_TYPES) | BRANCH_OPS | {wasm.OP_END, wasm.OP_ELSE, wasm.OP_BR_TABLE}
+
+# map from block result type to its rendered keyword.
+# ref: https://webassembly.github.io/spec/core/binary/types.html#binary-valtype
+BLOCK_VALTYPES = {
+    # TODO(wb): I don't think these constants will line up in practice
+    0x7F: 'type:i32',
+    0x7E: 'type:i64',
+    0x7D: 'type:f32',
+    0x7C: 'type:f64',
+}
+
+# flags of operands that are displayed.
+SHOW_FLAGS = ida_ua.OF_NO_BASE_DISP | ida_ua.OF_NUMBER | ida_ua.OF_SHOW
+
+# maximum size of an encoded varuint32 (LEB128).
+MAX_VARUINT32_SIZE = 5
+
+# number of bytes sufficient to decode any instruction other than `br_table`.
+# the largest fixed-size encodings are i64.const (opcode + varint64) and memory access (opcode + 2 varuint32).
+MAX_INSN_SIZE = 0x10
+
+# upper bound on the number of bytes read to decode a `br_table`,
+#  since its target count may come from arbitrary bytes outside a function body.
+MAX_BR_TABLE_SIZE = 0x10000
+
 
 def no_exceptions(f):
     """
@@ -68,11 +118,153 @@ def no_exceptions(f):
 ida_entry_point = no_exceptions
 
 
+@functools.lru_cache(maxsize=None)
+def render_signature(param_types: tuple[int, ...], return_count: int, return_type: Optional[int]) -> str:
+    """
+    render the parameters and result of a function type.
+    many functions share a type, so the rendered signatures are cached.
+
+    Example::
+
+        i32 = idawasm.const.WASM_TYPE_I32
+        assert render_signature((i32, i32), 1, i32) == ' (param $param0 i32) (param $param1 i32) (result i32)'
+
+    Args:
+      param_types (tuple[int, ...]): the value types of the parameters.
+      return_count (int): the number of results, zero or one.
+      return_type (Optional[int]): the value type of the result, if any.
+
+    Returns:
+      str: the rendered parameter and result clauses.
+    """
+    sparam = ''.join(f' (param $param{i} {idawasm.const.WASM_TYPE_NAMES[param]})'
+                     for i, param in enumerate(param_types))
+
+    if return_count == 0:
+        sresult = ''
+    elif return_count == 1:
+        sresult = f' (result {idawasm.const.WASM_TYPE_NAMES[return_type]})'
+    else:
+        raise NotImplementedError('multiple return values')
+
+    return sparam + sresult
+
+
 class SectionNotFoundError(Exception):
     def __init__(self, section_id):
         Exception.__init__(self, f'section not found: {section_id}')
 
 
+def compute_function_branch_targets(offset: int, code: bytes,
+                                    decoded: Optional[list[Instruction]] = None) -> dict[int, dict[str, Block]]:
+    """
+    compute branch targets for the given code segment.
+
+    we can do it in a single pass:
+    scan instructions, tracking new blocks, and maintaining a stack of nested blocks.
+    when we hit a branch instruction, use the stack to resolve the branch target.
+    the branch target will always come from the enclosing scope.
+
+    this is a pure function of the bytecode: it doesn't touch the IDA database.
+
+    Args:
+      offset (int): offset of the given code segment.
+      code (bytes): raw bytecode.
+      decoded (Optional[list[Instruction]]): the already decoded bytecode, if available.
+
+    Returns:
+      dict[int, dict[str, Block]]: map from instruction addresses to map from relative depth to branch target address.
+    """
+    # map from virtual address to map from relative depth to virtual address
+    branch_targets: dict[int, dict[str, Block]] = {}
+    # block instances, indexed by block index, with fields including `offset` and `depth`
+    blocks: list[Block] = []
+    # stack of block indexes, innermost block last
+    block_stack: list[int] = []
+    p = offset
+
+    if decoded is None:
+        decoded = wasm.decode_bytecode(code)
+
+    for bc in decoded:
+        op_id = bc.op.id
+        if op_id not in CONTROL_OPS:
+            # fast path: the vast majority of instructions don't touch control flow
+            p += bc.len
+            continue
+
+        if op_id in BLOCK_TYPES:
+            # enter a new block, so capture info, and push it onto the current depth stack
+            block_index = len(blocks)
+            block: Block = {
+                'index': block_index,
+                'offset': p,
+                'end_offset': None,
+                'else_offset': None,
+                'br_table_target': None,
+                'depth': len(block_stack),
+                'type': BLOCK_TYPES[op_id],
+            }
+            blocks.append(block)
+            block_stack.append(block_index)
+            branch_targets[p] = {
+                # reference to block that is starting
+                'block': block
+            }
+
+        elif op_id == wasm.OP_END:
+            if len(block_stack) == 0:
+                # end of function
+                branch_targets[p] = {
+                    'block': {
+                        'type': 'function',
+                        'offset': offset,  # start of function
+                        'end_offset': p,  # end of function
+                        'depth': 0,  # top level always has depth 0
+                    }
+                }
+                break
+
+            # leaving a block, so pop from the depth stack
+            block_index = block_stack.pop()
+            block = blocks[block_index]
+            block['end_offset'] = p + bc.len
+            branch_targets[p] = {
+                # reference to block that is ending
+                'block': block
+            }
+
+        elif op_id in BRANCH_OPS:
+            block_index = block_stack[-1 - bc.imm.relative_depth]
+            block = blocks[block_index]
+            branch_targets[p] = {
+                bc.imm.relative_depth: block
+            }
+
+        elif op_id == wasm.OP_ELSE:
+            for block_index in reversed(block_stack):
+                block = blocks[block_index]
+                if block['type'] == 'if':
+                    block['else_offset'] = p + bc.len
+                    branch_targets[p] = {
+                        # reference to block that is ending
+                        'block': block,
+                    }
+                    break
+
+        elif op_id == wasm.OP_BR_TABLE:
+            branch_targets[p] = {}
+            for relative_depth in *bc.imm.target_table, bc.imm.default_target:
+                block_index = block_stack[-1 - relative_depth]
+                block = blocks[block_index]
+                block['br_table_target'] = relative_depth
+                branch_targets[p][relative_depth] = block
+
+        p += bc.len
+
+    return branch_targets
+
+
 class wasm_processor_t(ida_idp.processor_t):
     # processor ID for the wasm disassembler.
     # I made this number up.
@@ -128,14 +320,7 @@ class wasm_processor_t(ida_idp.processor_t):
         """
         returns OOFW_xxx flag given a dt_xxx
         """
-        return {
-            ida_ua.dt_byte: ida_ua.OOFW_8,
-            ida_ua.dt_word: ida_ua.OOFW_16,
-            ida_ua.dt_dword: ida_ua.OOFW_32,
-            ida_ua.dt_qword: ida_ua.OOFW_64,
-            ida_ua.dt_float: ida_ua.OOFW_32,
-            ida_ua.dt_double: ida_ua.OOFW_64,
-        }[dt]
+        return DT_WIDTHS[dt]
 
     def _get_section(self, section_id: int) -> ModuleFragment:
         """
@@ -150,16 +335,10 @@ class wasm_processor_t(ida_idp.processor_t):
         Raises:
           SectionNotFoundError: if the section is not found.
         """
-        for i, section in enumerate(self.sections):
-            if i == 0:
-                continue
-
-            if section.data.id != section_id:
-                continue
-
-            return section
-
-        raise SectionNotFoundError(section_id)
+        try:
+            return self.section_index[section_id][0]
+        except KeyError:
+            raise SectionNotFoundError(section_id)
 
     def _get_section_offset(self, section_id: int) -> int:
         """
@@ -174,123 +353,65 @@ class wasm_processor_t(ida_idp.processor_t):
         Raises:
           SectionNotFoundError: if the section is not found.
         """
-        p = 0
-        for i, section in enumerate(self.sections):
-            if i == 0:
-                p += size_of(section.data)
-                continue
-
-            if section.data.id != section_id:
-                p += size_of(section.data)
-                continue
-
-            return p
+        try:
+            return self.section_index[section_id][1]
+        except KeyError:
+            raise SectionNotFoundError(section_id)
 
-        raise SectionNotFoundError(section_id)
+    def _index_sections(self) -> dict[int, tuple[ModuleFragment, int]]:
+        """
+        compute the map from section id to the section and its file offset.
+        the first section (the module header) is skipped, and if an id repeats, the first instance wins.
 
-    def _compute_function_branch_targets(self, offset: int, code: bytes) -> dict[int, dict[str, Block]]:
+        Returns:
+          dict[int, tuple[ModuleFragment, int]]: map from section id to (section, file offset).
         """
-        compute branch targets for the given code segment.
+        section_index: dict[int, tuple[ModuleFragment, int]] = {}
 
-        we can do it in a single pass:
-        scan instructions, tracking new blocks, and maintaining a stack of nested blocks.
-        when we hit a branch instruction, use the stack to resolve the branch target.
-        the branch target will always come from the enclosing scope.
+        p = 0
+        for i, section in enumerate(self.sections):
+            if i != 0 and section.data.id not in section_index:
+                section_index[section.data.id] = (section, p)
+            p += size_of(section.data)
 
-        Args:
-          offset (int): offset of the given code segment.
-          code (bytes): raw bytecode.
+        return section_index
 
-        Returns:
-          dict[int, dict[str, Block]]: map from instruction addresses to map from relative depth to branch target address.
+    def _decode_bodies(self) -> dict[int, list[Instruction]]:
         """
-        # map from virtual address to map from relative depth to virtual address
-        branch_targets: dict[int, dict[str, Block]] = {}
-        # map from block index to block instance, with fields including `offset` and `depth`
-        blocks: dict[int, Block] = {}
-        # stack of block indexes
-        block_stack: deque[int] = deque()
-        p = offset
-
-        for bc in wasm.decode_bytecode(code):
-            if bc.op.id in {wasm.OP_BLOCK, wasm.OP_LOOP, wasm.OP_IF}:
-                # enter a new block, so capture info, and push it onto the current depth stack
-                block_index = len(blocks)
-                block: Block = {
-                    'index': block_index,
-                    'offset': p,
-                    'end_offset': None,
-                    'else_offset': None,
-                    'br_table_target': None,
-                    'depth': len(block_stack),
-                    'type': {
-                        wasm.OP_BLOCK: 'block',
-                        wasm.OP_LOOP: 'loop',
-                        wasm.OP_IF: 'if',
-                    }[bc.op.id],
-                }
-                blocks[block_index] = block
-                block_stack.appendleft(block_index)
-                branch_targets[p] = {
-                    # reference to block that is starting
-                    'block': block
-                }
+        decode the bytecode of each function body, once.
 
-            elif bc.op.id in {wasm.OP_END}:
-                if len(block_stack) == 0:
-                    # end of function
-                    branch_targets[p] = {
-                        'block': {
-                            'type': 'function',
-                            'offset': offset,  # start of function
-                            'end_offset': p,  # end of function
-                            'depth': 0,  # top level always has depth 0
-                        }
-                    }
-                    break
+        Returns:
+          dict[int, list[Instruction]]: map from function offset to the decoded instructions.
+        """
+        decoded_bodies: dict[int, list[Instruction]] = {}
 
-                # leaving a block, so pop from the depth stack
-                block_index = block_stack.popleft()
-                block = blocks[block_index]
-                block['end_offset'] = p + bc.len
-                branch_targets[p] = {
-                    # reference to block that is ending
-                    'block': block
-                }
+        code_section = self._get_section(wasm.wasmtypes.SEC_CODE)
+        pcode_section = self._get_section_offset(wasm.wasmtypes.SEC_CODE)
 
-                br_table_target = block['br_table_target']
-                if br_table_target is not None:
-                    ida_bytes.set_cmt(block['end_offset'], 'table %d' % br_table_target, 0)
+        ppayload = pcode_section + offset_of(code_section.data, 'payload')
+        pbody = ppayload + offset_of(code_section.data.payload, 'bodies')
+        for body in code_section.data.payload.bodies:
+            pcode = pbody + offset_of(body, 'code')
+            decoded_bodies[pcode] = list(wasm.decode_bytecode(body.code))
+            pbody += size_of(body)
 
-            elif bc.op.id in {wasm.OP_BR, wasm.OP_BR_IF}:
-                block_index = block_stack[bc.imm.relative_depth]
-                block = blocks[block_index]
-                branch_targets[p] = {
-                    bc.imm.relative_depth: block
-                }
+        return decoded_bodies
 
-            elif bc.op.id in {wasm.OP_ELSE}:
-                for block_index in block_stack:
-                    block = blocks[block_index]
-                    if block['type'] == 'if':
-                        block['else_offset'] = p + bc.len
-                        branch_targets[p] = {
-                            # reference to block that is ending
-                            'block': block,
-                        }
-                        break
-
-            elif bc.op.id in {wasm.OP_BR_TABLE}:
-                branch_targets[p] = {}
-                for relative_depth in *bc.imm.target_table, bc.imm.default_target:
-                    block_index = block_stack[relative_depth]
-                    block = blocks[block_index]
-                    block['br_table_target'] = relative_depth
-                    branch_targets[p][relative_depth] = block
+    def _index_decoded_insns(self) -> dict[int, Instruction]:
+        """
+        compute the map from address to decoded instruction, from the decoded function bodies.
 
-            p += bc.len
+        Returns:
+          dict[int, Instruction]: map from instruction address to the decoded instruction.
+        """
+        decoded_insns: dict[int, Instruction] = {}
+        for offset, decoded in self.decoded_bodies.items():
+            p = offset
+            for bc in decoded:
+                decoded_insns[p] = bc
+                p += bc.len
 
-        return branch_targets
+        return decoded_insns
 
     def _compute_branch_targets(self) -> dict[int, dict[str, Block]]:
         branch_targets: dict[int, dict[str, Block]] = {}
@@ -302,11 +423,67 @@ class wasm_processor_t(ida_idp.processor_t):
         pbody = ppayload + offset_of(code_section.data.payload, 'bodies')
         for body in code_section.data.payload.bodies:
             pcode = pbody + offset_of(body, 'code')
-            branch_targets.update(self._compute_function_branch_targets(pcode, body.code))
+            decoded = self.decoded_bodies.get(pcode)
+            branch_targets.update(compute_function_branch_targets(pcode, body.code, decoded=decoded))
             pbody += size_of(body)
 
+        # annotate the end of each block targeted by a branch table.
+        table_comments: dict[int, int] = {}
+        for targets in branch_targets.values():
+            for block in targets.values():
+                if block.get('br_table_target') is not None and block['end_offset'] is not None:
+                    table_comments[block['end_offset']] = block['br_table_target']
+
+        for end_offset, br_table_target in table_comments.items():
+            ida_bytes.set_cmt(end_offset, 'table %d' % br_table_target, 0)
+
         return branch_targets
 
+    def _compute_branch_edges(self) -> dict[int, tuple[int, ...]]:
+        """
+        flatten the branch targets of BR, BR_IF, and BR_TABLE instructions into target addresses,
+         so that emulating a branch is a single lookup.
+
+        Returns:
+          dict[int, tuple[int, ...]]: map from branch instruction address to the addresses it may branch to.
+            BR and BR_IF have exactly one target.
+        """
+        branch_edges: dict[int, tuple[int, ...]] = {}
+        for ea, targets in self.branch_targets.items():
+            # block starts and ends are keyed by 'block', branches by relative depth.
+            if 'block' in targets:
+                continue
+
+            branch_edges[ea] = tuple(block['end_offset'] for block in targets.values())
+
+        return branch_edges
+
+    def _compute_line_annotations(self) -> dict[int, tuple[Optional[Function], Optional[str]]]:
+        """
+        precompute what `ev_out_insn` adds to instructions,
+         so that rendering a line is a single lookup.
+
+        function prototypes are rendered (and cached) by `ev_out_insn`,
+         so that a function that fails to render doesn't prevent the module from loading.
+
+        Returns:
+          dict[int, tuple[Optional[Function], Optional[str]]]: map from address to
+            (function starting here, block label).
+            the block label only applies to BLOCK, LOOP, IF, and END instructions.
+        """
+        annotations: dict[int, tuple[Optional[Function], Optional[str]]] = {}
+
+        for ea, targets in self.branch_targets.items():
+            block = targets.get('block')
+            if block is not None and block['type'] in ('block', 'loop', 'if'):
+                annotations[ea] = (None, '$%s%d' % (block['type'], block['index']))
+
+        for ea, function in self.function_offsets.items():
+            label = annotations.get(ea, (None, None))[1]
+            annotations[ea] = (function, label)
+
+        return annotations
+
     def _parse_types(self) -> list[dict[str, Any]]:
         """
         parse the type entries.
@@ -337,8 +514,8 @@ class wasm_processor_t(ida_idp.processor_t):
         for body in import_section.data.payload.entries:
             if body.kind == idawasm.const.WASM_EXTERNAL_KIND_GLOBAL:
                 ctype = idawasm.const.WASM_TYPE_NAMES[body.type.content_type]
-                module = body.module_str.tobytes().decode('utf-8')
-                field = body.field_str.tobytes().decode('utf-8')
+                module = decode_str(body.module_str)
+                field = decode_str(body.field_str)
                 globals_[i] = {
                     'index': i,
                     'offset': pcur,
@@ -398,9 +575,6 @@ class wasm_processor_t(ida_idp.processor_t):
             i += 1
             pcur += size_of(body)
 
-        for global_ in globals_.values():
-            ida_name.set_name(global_['offset'], global_['name'], ida_name.SN_CHECK)
-
         return globals_
 
     def _parse_imported_functions(self) -> dict[int, dict[str, Any]]:
@@ -425,8 +599,8 @@ class wasm_processor_t(ida_idp.processor_t):
 
             functions[function_index] = {
                 'index': function_index,
-                'module': entry.module_str.tobytes().decode('utf-8'),
-                'name': entry.field_str.tobytes().decode('utf-8'),
+                'module': decode_str(entry.module_str),
+                'name': decode_str(entry.field_str),
                 'type': struc_to_dict(ftype),
                 'imported': True,
                 # TODO: not sure if an import can be exported.
@@ -437,29 +611,23 @@ class wasm_processor_t(ida_idp.processor_t):
 
         return functions
 
-    def _parse_exported_functions(self) -> dict[int, dict[str, Any]]:
+    def _parse_exported_function_names(self) -> dict[int, str]:
         """
         parse the export entries for functions.
         useful for recovering function names.
 
         Returns:
-          dict[int, dict[str, any]]: from function index to dict with keys `index` and `name`.
+          dict[int, str]: from function index to exported name.
         """
-        functions: dict[int, Function] = {}
+        names: dict[int, str] = {}
         export_section = self._get_section(wasm.wasmtypes.SEC_EXPORT)
         for entry in export_section.data.payload.entries:
             if entry.kind != idawasm.const.WASM_EXTERNAL_KIND_FUNCTION:
                 continue
 
-            functions[entry.index] = {
-                'index': entry.index,
-                'name': entry.field_str.tobytes().decode('utf-8'),
-                'exported': True,
-                # TODO: not sure if an export can be imported.
-                'imported': False,
-            }
+            names[entry.index] = decode_str(entry.field_str)
 
-        return functions
+        return names
 
     def _parse_functions(self) -> dict[int, Function]:
         try:
@@ -467,9 +635,9 @@ class wasm_processor_t(ida_idp.processor_t):
         except SectionNotFoundError:
             imported_functions = {}
         try:
-            exported_functions = self._parse_exported_functions()
+            exported_names = self._parse_exported_function_names()
         except SectionNotFoundError:
-            exported_functions = []
+            exported_names = {}
 
         functions: dict[int, Function] = dict(imported_functions)
 
@@ -481,24 +649,18 @@ class wasm_processor_t(ida_idp.processor_t):
         payload = code_section.data.payload
         ppayload = pcode_section + offset_of(code_section.data, 'payload')
         pbody = ppayload + offset_of(payload, 'bodies')
-        for i in range(code_section.data.payload.count):
-            function_index = len(imported_functions) + i
-            body = code_section.data.payload.bodies[i]
-            type_index = function_section.data.payload.types[i]
+        function_index = len(imported_functions)
+        for body, type_index in zip(payload.bodies, function_section.data.payload.types):
             ftype = type_section.data.payload.entries[type_index]
 
             local_types = []
             for locals_group in body.locals:
-                ltype = locals_group.type
-                for j in range(locals_group.count):
-                    local_types.append(ltype)
+                local_types.extend([locals_group.type] * locals_group.count)
 
-            if function_index in exported_functions:
-                name = exported_functions[function_index]['name']
-                is_exported = True
-            else:
+            name = exported_names.get(function_index)
+            is_exported = name is not None
+            if not is_exported:
                 name = '$func%d' % function_index
-                is_exported = False
 
             functions[function_index] = {
                 'index': function_index,
@@ -511,6 +673,7 @@ class wasm_processor_t(ida_idp.processor_t):
                 'size': size_of(body, 'code'),
             }
 
+            function_index += 1
             pbody += size_of(body)
 
         return functions
@@ -553,20 +716,12 @@ class wasm_processor_t(ida_idp.processor_t):
         else:
             name = ' ' + name
 
-        params = []
-        if type_['param_count'] > 0:
-            for i, param in enumerate(type_['param_types']):
-                params.append(' (param $param%d %s)' % (i, idawasm.const.WASM_TYPE_NAMES[param]))
-        sparam = ''.join(params)
+        # fields with no content, such as an empty `param_types`, are omitted by `struc_to_dict`.
+        signature = render_signature(tuple(type_.get('param_types', ())),
+                                     type_['return_count'],
+                                     type_.get('return_type'))
 
-        if type_['return_count'] == 0:
-            sresult = ''
-        elif type_['return_count'] == 1:
-            sresult = ' (result %s)' % (idawasm.const.WASM_TYPE_NAMES[type_['return_type']])
-        else:
-            raise NotImplementedError('multiple return values')
-
-        return '(func%s%s%s)' % (name, sparam, sresult)
+        return f'(func{name}{signature})'
 
     def _render_function_prototype(self, function) -> str:
         if function.get('imported'):
@@ -582,31 +737,87 @@ class wasm_processor_t(ida_idp.processor_t):
         bc = self._decode_bytecode_at(addr)
         return '[%s]' % ','.join(map(str, bc.imm.target_table))
 
-    def load(self):
+    def _apply_names(self):
+        """
+        name the globals and functions in the database.
+        names are only written when they differ, since each write is a database update.
+        """
+        for global_ in self.globals.values():
+            if ida_name.get_name(global_['offset']) != global_['name']:
+                ida_name.set_name(global_['offset'], global_['name'], ida_name.SN_CHECK)
+
+        for function in self.functions.values():
+            if 'offset' in function and ida_name.get_name(function['offset']) != function['name']:
+                ida_name.set_name(function['offset'], function['name'], ida_name.SN_CHECK)
+
+    def _rendered_type(self, type_index: int) -> str:
+        """
+        fetch the rendered signature of the given type index, rendering it on first use.
+        """
+        signature = self.rendered_types.get(type_index)
+        if signature is None:
+            signature = self._render_type(self.types[type_index])
+            self.rendered_types[type_index] = signature
+        return signature
+
+    def _rendered_function_prototype(self, function) -> str:
+        """
+        fetch the rendered prototype of the given function, rendering it on first use.
+        """
+        proto = self.rendered_prototypes.get(function['index'])
+        if proto is None:
+            proto = self._render_function_prototype(function)
+            self.rendered_prototypes[function['index']] = proto
+        return proto
+
+    def _rendered_branch_table(self, addr: int) -> str:
+        """
+        fetch the rendered branch table of the br_table at the given address, rendering it on first use.
+        """
+        branch_table = self.rendered_branch_tables.get(addr)
+        if branch_table is None:
+            branch_table = self._render_branch_table(addr)
+            self.rendered_branch_tables[addr] = branch_table
+        return branch_table
+
+    def load(self, apply_names: bool = True):
         """
         load the state of the processor and analysis from the segments.
 
         the processor object may not be re-created, so we do our initialization here.
+        when `apply_names` is set, name globals and functions in the database;
+         otherwise (e.g. for an existing database), keep the names already stored there.
         initialize the following fields:
 
           - self.buf
           - self.sections
+          - self.section_index
           - self.functions
           - self.function_offsets
-          - self.function_ranges
+          - self.function_starts, self.function_ends, self.sorted_functions
           - self.globals
+          - self.data
+          - self.data_starts, self.data_ends, self.data_max_ends, self.data_eas
+          - self.decoded_bodies
+          - self.decoded_insns
           - self.branch_targets
+          - self.branch_edges
+          - self.line_annotations
         """
         logger.info('parsing sections')
-        buf = []
-        for n in range(ida_segment.get_segm_qty()):
-            # assume all the segments are contiguous, which is what our loader does
-            seg = ida_segment.getnseg(n)
-            if seg:
-                buf.append(ida_bytes.get_bytes(seg.start_ea, seg.end_ea - seg.start_ea))
+        # assume all the segments are contiguous, which is what our loader does
+        segs = [seg for seg in map(ida_segment.getnseg, range(ida_segment.get_segm_qty())) if seg]
+
+        # fill a single pre-sized buffer, rather than joining a list of per-segment copies.
+        self.buf = bytearray(sum(seg.end_ea - seg.start_ea for seg in segs))
+        p = 0
+        for seg in segs:
+            size = seg.end_ea - seg.start_ea
+            self.buf[p:p + size] = ida_bytes.get_bytes(seg.start_ea, size)
+            p += size
 
-        self.buf = b''.join(buf)
         self.sections = list(wasm.decode_module(self.buf))
+        self.section_index = self._index_sections()
 
         logger.info('parsing types')
         try:
@@ -629,12 +840,12 @@ class wasm_processor_t(ida_idp.processor_t):
         # map from function offset to function object
         self.function_offsets = {f['offset']: f for f in self.functions.values() if 'offset' in f}
 
-        # map from (function start, function end) to function object
-        self.function_ranges = {
-            (f['offset'], f['offset'] + f['size']): f
-            for f in self.functions.values()
-            if 'offset' in f
-        }
+        # function objects sorted by offset, with parallel arrays of their (start, end) addresses.
+        # functions don't overlap, so the function containing an address can be found by bisection.
+        self.sorted_functions = sorted(self.function_offsets.values(), key=lambda f: f['offset'])
+        self.function_starts = array.array('Q', (f['offset'] for f in self.sorted_functions))
+        self.function_ends = array.array('Q', (f['offset'] + f['size'] for f in self.sorted_functions))
+        self.last_function = None
 
         logger.info('parsing data')
         try:
@@ -642,16 +853,44 @@ class wasm_processor_t(ida_idp.processor_t):
         except SectionNotFoundError as e:
             logger.info(f'failed to parse data: {e}')
 
+        # (va-start, va-end, ea) of data segments sorted by va, as parallel arrays.
+        # data segments may overlap (e.g. segments without a constant offset all start at zero),
+        #  so also track the maximum va-end of each prefix of the sorted segments.
+        # the segments containing an address are then found by bisection,
+        #  and walking back while an earlier segment may still reach the address.
+        sorted_data = sorted(self.data.values(), key=lambda d: d['offset'])
+        self.data_starts = array.array('q', (d['offset'] for d in sorted_data))
+        self.data_ends = array.array('q', (d['offset'] + d['size'] for d in sorted_data))
+        self.data_max_ends = array.array('q', itertools.accumulate(self.data_ends, max))
+        self.data_eas = array.array('Q', (d['ea'] for d in sorted_data))
+
+        logger.info('decoding function bodies')
+        try:
+            self.decoded_bodies = self._decode_bodies()
+        except SectionNotFoundError as e:
+            logger.info(f'failed to decode function bodies: {e}')
+        self.decoded_insns = self._index_decoded_insns()
+
         logger.info('computing branch targets')
         self.branch_targets = self._compute_branch_targets()
+        self.branch_edges = self._compute_branch_edges()
+        self.line_annotations = self._compute_line_annotations()
 
-        self.deferred_noflows = {}
+        self.deferred_noflows = set()
         self.deferred_flows = {}
 
+        # rendered text is derived from the state above, so drop anything rendered from a previous load.
+        self.rendered_prototypes = {}
+        self.rendered_types = {}
+        self.rendered_branch_tables = {}
+
+        # the `_parse_*` phases only compute state, so names are applied here.
+        if apply_names:
+            self._apply_names()
+
         for function in self.functions.values():
             name = function['name']
             if 'offset' in function:
-                ida_name.set_name(function['offset'], name, ida_name.SN_CHECK)
                 # notify_emu will be invoked from here.
                 ida_ua.create_insn(function['offset'])
                 ida_funcs.add_func(function['offset'], function['offset'] + function['size'])
@@ -692,7 +931,8 @@ class wasm_processor_t(ida_idp.processor_t):
         handle file loaded from existing .idb database.
         """
         logger.info('existing database: %s', filename)
-        self.load()
+        # names are already persisted in the database, possibly renamed by the user.
+        self.load(apply_names=False)
 
         return 0
 
@@ -720,8 +960,7 @@ class wasm_processor_t(ida_idp.processor_t):
         Returns:
           Optional[str]: the comment string, or None.
         """
-        if 'cmt' in self.instruc[insn.itype]:
-            return self.instruc[insn.itype]['cmt']
+        return self.insn_cmts[insn.itype]
 
     @ida_entry_point
     def ev_may_be_func(self, insn: ida_ua.insn_t, state) -> int:
@@ -743,14 +982,12 @@ class wasm_processor_t(ida_idp.processor_t):
         ida_xref.add_cref(insn.ea, insn.ea + insn.size, ida_xref.fl_F)
 
         # unconditional branch, so END does not flow to following instruction
-        self.deferred_noflows[next.ea] = True
+        self.deferred_noflows.add(next.ea)
 
         # branch target
-        if insn.ea in self.branch_targets:
-            targets = self.branch_targets[insn.ea]
-            target_block = targets[insn.Op1.value]
-            target_va = target_block['end_offset']
-            self.deferred_flows[next.ea] = [(next.ea, target_va, ida_xref.fl_JF)]
+        target_vas = self.branch_edges.get(insn.ea)
+        if target_vas is not None:
+            self.deferred_flows[next.ea] = [(next.ea, target_vas[0], ida_xref.fl_JF)]
 
         return 1
 
@@ -763,20 +1000,15 @@ class wasm_processor_t(ida_idp.processor_t):
         pass
 
         # branch target
-        if insn.ea in self.branch_targets:
-            targets = self.branch_targets[insn.ea]
-            target_block = targets[insn.Op1.value]
-            target_va = target_block['end_offset']
-            self.deferred_flows[next.ea] = [(next.ea, target_va, ida_xref.fl_JF)]
+        target_vas = self.branch_edges.get(insn.ea)
+        if target_vas is not None:
+            self.deferred_flows[next.ea] = [(next.ea, target_vas[0], ida_xref.fl_JF)]
 
         return 1
 
     def notify_emu_BR_TABLE_END(self, insn: ida_ua.insn_t, next: ida_ua.insn_t) -> int:
-        if insn.ea in self.branch_targets:
-            targets = self.branch_targets[insn.ea]
-            for target_block in targets.values():
-                target_va = target_block['end_offset']
-                ida_xref.add_cref(insn.ea, target_va, ida_xref.fl_JF)
+        for target_va in self.branch_edges.get(insn.ea, ()):
+            ida_xref.add_cref(insn.ea, target_va, ida_xref.fl_JF)
 
         return 1
 
@@ -785,13 +1017,13 @@ class wasm_processor_t(ida_idp.processor_t):
         ida_xref.add_cref(insn.ea, insn.ea + insn.size, ida_xref.fl_F)
 
         # but the END will not fallthrough.
-        self.deferred_noflows[next.ea] = True
+        self.deferred_noflows.add(next.ea)
 
         return 1
 
     def notify_emu_UNREACHABLE_END(self, insn: ida_ua.insn_t, next: ida_ua.insn_t) -> int:
         # but the END will not fallthrough.
-        self.deferred_noflows[next.ea] = True
+        self.deferred_noflows.add(next.ea)
 
         return 0
 
@@ -802,11 +1034,9 @@ class wasm_processor_t(ida_idp.processor_t):
         pass
 
         # branch target
-        if insn.ea in self.branch_targets:
-            targets = self.branch_targets[insn.ea]
-            target_block = targets[insn.Op1.value]
-            target_va = target_block['end_offset']
-            ida_xref.add_cref(insn.ea, target_va, ida_xref.fl_JF)
+        target_vas = self.branch_edges.get(insn.ea)
+        if target_vas is not None:
+            ida_xref.add_cref(insn.ea, target_vas[0], ida_xref.fl_JF)
 
         return 1
 
@@ -816,19 +1046,21 @@ class wasm_processor_t(ida_idp.processor_t):
         ida_xref.add_cref(insn.ea, insn.ea + insn.size, ida_xref.fl_F)
 
         # branch target
-        if insn.ea in self.branch_targets:
-            targets = self.branch_targets[insn.ea]
-            target_block = targets[insn.Op1.value]
-            target_va = target_block['end_offset']
-            ida_xref.add_cref(insn.ea, target_va, ida_xref.fl_JF)
+        target_vas = self.branch_edges.get(insn.ea)
+        if target_vas is not None:
+            ida_xref.add_cref(insn.ea, target_vas[0], ida_xref.fl_JF)
 
         return 1
 
+    def notify_emu_BR_TABLE(self, insn: ida_ua.insn_t) -> int:
+        # haven't seen one of these yet, so don't know to handle exactly.
+        raise NotImplementedError('br table')
+
     def notify_emu_IF(self, insn: ida_ua.insn_t) -> int:
         ida_xref.add_cref(insn.ea, insn.ea + insn.size, ida_xref.fl_F)
 
-        if insn.ea in self.branch_targets:
-            targets = self.branch_targets[insn.ea]
+        targets = self.branch_targets.get(insn.ea)
+        if targets is not None:
             for target_block in targets.values():
                 else_va = target_block['else_offset']
                 if else_va:
@@ -840,8 +1072,8 @@ class wasm_processor_t(ida_idp.processor_t):
         return 1
 
     def notify_emu_ELSE(self, insn: ida_ua.insn_t) -> int:
-        if insn.ea in self.branch_targets:
-            targets = self.branch_targets[insn.ea]
+        targets = self.branch_targets.get(insn.ea)
+        if targets is not None:
             for target_block in targets.values():
                 target_va = target_block['end_offset']
                 ida_xref.add_cref(insn.ea, target_va, ida_xref.fl_JF)
@@ -852,8 +1084,8 @@ class wasm_processor_t(ida_idp.processor_t):
         for flow in self.deferred_flows.get(insn.ea, []):
             ida_xref.add_cref(*flow)
 
-        if insn.ea in self.branch_targets:
-            targets = self.branch_targets[insn.ea]
+        targets = self.branch_targets.get(insn.ea)
+        if targets is not None:
             block = targets['block']
             if block['type'] == 'loop':
                 # end of loop
@@ -940,127 +1172,71 @@ class wasm_processor_t(ida_idp.processor_t):
         so, we have to used this "deferred" approach.
         """
 
-        next = ida_ua.insn_t()
-        if not ida_ua.decode_insn(next, insn.ea + insn.size):
-            next = None
-
-        # add drefs to globals
-        for op in insn.ops:
-            if not (op.type == ida_ua.o_imm and op.specval == WASM_GLOBAL):
-                continue
+        # insn fields are proxied through SWIG, so read the frequently used ones once.
+        itype = insn.itype
+        ea = insn.ea
 
-            if op.value not in self.globals:
-                logger.debug('missing global: %d', op.value)
-                continue
+        # only the instructions handled specially when followed by an END (or UNREACHABLE)
+        #  need to decode the next instruction.
+        next = None
+        if itype in self.peek_itypes:
+            next = ida_ua.insn_t()
+            if not ida_ua.decode_insn(next, ea + insn.size):
+                next = None
 
-            global_va = self.globals[op.value]['offset']
-            if insn.itype == self.itype_SET_GLOBAL:
-                ida_xref.add_dref(insn.ea, global_va, ida_xref.dr_W)
-            elif insn.itype == self.itype_GET_GLOBAL:
-                ida_xref.add_dref(insn.ea, global_va, ida_xref.dr_R)
+        # add drefs to globals
+        if itype == self.itype_GET_GLOBAL or itype == self.itype_SET_GLOBAL:
+            global_index = insn.Op1.value
+            global_ = self.globals.get(global_index)
+            if global_ is None:
+                logger.debug('missing global: %d', global_index)
+            elif itype == self.itype_SET_GLOBAL:
+                ida_xref.add_dref(ea, global_['offset'], ida_xref.dr_W)
             else:
-                raise RuntimeError('unexpected instruction referencing global: ' + str(insn))
+                ida_xref.add_dref(ea, global_['offset'], ida_xref.dr_R)
 
         # add drefs to data
-        for op in insn.ops:
-            if op.type == ida_ua.o_imm and op.dtype == ida_ua.dt_dword:
-                va = op.value
-                for data in self.data.values():
-                    if data['offset'] <= va <= data['offset'] + data['size']:
-                        ida_xref.add_dref(insn.ea, va - data['offset'] + data['ea'], ida_xref.dr_R)
+        elif itype in self.data_ref_itypes and self.data_starts:
+            data_starts = self.data_starts
+            data_ends = self.data_ends
+            data_max_ends = self.data_max_ends
+            va = insn.Op1.value
+            # every segment containing the address gets a reference, see `load`.
+            i = bisect.bisect_right(data_starts, va) - 1
+            while i >= 0 and va <= data_max_ends[i]:
+                if va <= data_ends[i]:
+                    ida_xref.add_dref(ea, va - data_starts[i] + self.data_eas[i], ida_xref.dr_R)
+                i -= 1
 
         # TODO: add drefs to memory, but need example of this first.
 
-        # handle cases like:
-        #
-        #     block
-        #     ...
-        #     br $foo
-        #     end
-        #
-        # we want the cref to flow from the instruction `end`, not `br $foo`.
-        if (insn.itype in {self.itype_BR,
-                           self.itype_BR_IF,
-                           self.itype_BR_TABLE}
-                and next is not None  # NOQA: E127 continuation line over-indented for visual indent
-                and next.itype == self.itype_END):  # NOQA: E127
-
-            if insn.itype == self.itype_BR:
-                return self.notify_emu_BR_END(insn, next)
-
-            elif insn.itype == self.itype_BR_IF:
-                return self.notify_emu_BR_IF_END(insn, next)
-
-            elif insn.itype == self.itype_BR_TABLE:
-                return self.notify_emu_BR_TABLE_END(insn, next)
-
-        # handle cases like:
-        #
-        #     ...
-        #     return
-        #     end
-        #
-        # we want return to flow into the return, which should then not flow.
-        elif (insn.itype == self.itype_RETURN
-              and next is not None
-              and next.itype == self.itype_END):
-            return self.notify_emu_RETURN_END(insn, next)
-
-        # handle cases like:
-        #
-        #     ...
-        #     unreachable
-        #     end
-        elif (insn.itype == self.itype_UNREACHABLE
-              and next is not None
-              and next.itype == self.itype_END):
-            return self.notify_emu_UNREACHABLE_END(insn, next)
-
-        # handle cases like:
-        #
-        #     ...
-        #     br $foo
-        #     unreachable
-        elif (insn.itype == self.itype_BR
-              and next is not None
-              and next.itype == self.itype_UNREACHABLE):
-            return 1
+        if next is not None:
+            # handle branches, RETURN, and UNREACHABLE followed by an END, see `init_emu_handlers`.
+            if next.itype == self.itype_END:
+                end_handler = self.emu_end_handlers[itype]
+                if end_handler is not None:
+                    return end_handler(insn, next)
+
+            # handle cases like:
+            #
+            #     ...
+            #     br $foo
+            #     unreachable
+            elif itype == self.itype_BR and next.itype == self.itype_UNREACHABLE:
+                return 1
 
         # handle other RETURN and UNREACHABLE instructions.
         # tbh, not sure how we'd encounter another RETURN, but we'll be safe.
-        elif insn.get_canon_feature() & wasm.INSN_NO_FLOW:
+        if itype in self.noflow_itypes:
             return 1
 
-        # handle an unconditional branch not at the end of a black.
-        elif insn.itype == self.itype_BR:
-            return self.notify_emu_BR(insn)
-
-        elif insn.itype == self.itype_BR_TABLE:
-            # haven't seen one of these yet, so don't know to handle exactly.
-            raise NotImplementedError('br table')
-
-        # handle a conditional branch not at the end of a block.
-        elif insn.itype == self.itype_BR_IF:
-            return self.notify_emu_BR_IF(insn)
-
-        elif insn.itype == self.itype_IF:
-            return self.notify_emu_IF(insn)
-
-        elif insn.itype == self.itype_ELSE:
-            return self.notify_emu_ELSE(insn)
-
-        # add flows deferred from a prior branch, eg.
-        #
-        #     br $foo
-        #     end
-        #
-        # flows deferred from the BR to the END insn.
-        elif insn.itype == self.itype_END:
-            return self.notify_emu_END(insn)
+        # handle the remaining control flow instructions, see `init_emu_handlers`.
+        handler = self.emu_handlers[itype]
+        if handler is not None:
+            return handler(insn)
 
         # default behavior: fallthrough
-        else:
-            ida_xref.add_cref(insn.ea, insn.ea + insn.size, ida_xref.fl_F)
+        ida_xref.add_cref(ea, ea + insn.size, ida_xref.fl_F)
 
     @ida_entry_point
     def out_mnem(self, ctx) -> None:
@@ -1071,10 +1247,16 @@ class wasm_processor_t(ida_idp.processor_t):
         """
         fetch the function object that contains the given address.
         """
-        # warning: O(#funcs) scan here, called in a tight loop (render operand).
-        for (start, end), f in self.function_ranges.items():
-            if start <= ea < end:
-                return f
+        # operands are rendered in address order, so consecutive lookups usually hit the same function.
+        last = self.last_function
+        if last is not None and last[0] <= ea < last[1]:
+            return last[2]
+
+        i = bisect.bisect_right(self.function_starts, ea) - 1
+        if i >= 0 and ea < self.function_ends[i]:
+            f = self.sorted_functions[i]
+            self.last_function = (self.function_starts[i], self.function_ends[i], f)
+            return f
         raise KeyError(ea)
 
     @ida_entry_point
@@ -1092,15 +1274,8 @@ class wasm_processor_t(ida_idp.processor_t):
                 # block has empty type
                 pass
             else:
-                # ref: https://webassembly.github.io/spec/core/binary/types.html#binary-valtype
                 # TODO(wb): untested!
-                ctx.out_keyword({
-                                    # TODO(wb): I don't think these constants will line up in practice
-                                    0x7F: 'type:i32',
-                                    0x7E: 'type:i64',
-                                    0x7D: 'type:f32',
-                                    0x7C: 'type:f64',
-                                }[op.value])
+                ctx.out_keyword(BLOCK_VALTYPES[op.value])
             return True
 
         elif op.type == ida_ua.o_reg:
@@ -1177,9 +1352,7 @@ class wasm_processor_t(ida_idp.processor_t):
                 #     code:0B7F  call_indirect  (func (param $param0 i32) (param $param1 i32) (result i32)), 0
                 #                  ^
                 #                 this thing
-                type_index = op.value
-                type = self.types[type_index]
-                signature = self._render_type(type)
+                signature = self._rendered_type(op.value)
 
                 ctx.out_keyword(signature)
                 return True
@@ -1205,7 +1378,7 @@ class wasm_processor_t(ida_idp.processor_t):
                 #     code:XXXX   br_table    3, [0,1,2], default:0
                 #                                  ^
                 #                                 this thing
-                branch_table = self._render_branch_table(op.addr)
+                branch_table = self._rendered_branch_table(op.addr)
                 ctx.out_keyword(branch_table)
                 return True
 
@@ -1240,16 +1413,18 @@ class wasm_processor_t(ida_idp.processor_t):
         insn = ctx.insn
         ea = insn.ea
 
+        # function starting here and block label, see `_compute_line_annotations`.
+        fn, label = self.line_annotations.get(ea, (None, None))
+
         # if this is the start of a function, render the function prototype.
         # like::
         #
         #     code:082E $func8:
         #     code:082E (func $func8 (param $param0 i32) (param $param1 i32) (result i32))
-        if ea in self.function_offsets:
+        if fn is not None:
             # use idaapi.rename_regvar and idaapi.find_regvar to resolve $local/$param names
             # ref: https://reverseengineering.stackexchange.com/q/3038/17194
-            fn = self.function_offsets[ea]
-            proto = self._render_function_prototype(fn)
+            proto = self._rendered_function_prototype(fn)
             ctx.gen_printf(0, proto + '\n')
 
         # the instruction has a mnemonic, then zero or more operands.
@@ -1268,12 +1443,8 @@ class wasm_processor_t(ida_idp.processor_t):
         ctx.out_mnemonic()
         ctx.out_one_operand(0)
 
-        for i in range(1, 3):
-            op = insn[i]
-
-            if op.type == ida_ua.o_void:
-                break
-
+        # the number of operands is fixed by the instruction, see `init_instructions`.
+        for i in range(1, self.insn_operand_counts[insn.itype]):
             ctx.out_symbol(',')
             ctx.out_char(' ')
             ctx.out_one_operand(i)
@@ -1306,30 +1477,178 @@ class wasm_processor_t(ida_idp.processor_t):
         #
         #     code:0E77     br_if        loc_error
 
-        if insn.itype in (self.itype_BLOCK, self.itype_LOOP, self.itype_IF, self.itype_END) \
-                and ea in self.branch_targets:
-
-            targets = self.branch_targets[ea]
-            block = targets['block']
-            if block['type'] in ('block', 'loop', 'if'):
-                ctx.out_tagon(ida_lines.COLOR_UNAME)
-                for c in ("$" + block['type'] + str(block['index'])):
-                    ctx.out_char(c)
-                ctx.out_tagoff(ida_lines.COLOR_UNAME)
+        if label is not None and insn.itype in self.block_itypes:
+            # `out_line` with a color wraps the string in the color tags.
+            ctx.out_line(label, ida_lines.COLOR_UNAME)
 
         ctx.set_gen_cmt()
         ctx.flush_outbuf()
 
     def _decode_bytecode_at(self, addr: int) -> Instruction:
-        for i in range(1, 5):
-            try:
-                buf = ida_bytes.get_bytes(addr, 0x10 ** i)
-                bc = next(wasm.decode_bytecode(buf))
-                return bc
-            except:  # NOQA: E722 do not use bare 'except'
-                pass
+        # instructions within function bodies were decoded during load.
+        bc = self.decoded_insns.get(addr)
+        if bc is not None:
+            return bc
+
+        buf = ida_bytes.get_bytes(addr, MAX_INSN_SIZE)
+        if buf and buf[0] == wasm.OP_BR_TABLE:
+            # br_table has a variable-length operand: target_count, target_table, default_target.
+            # read exactly enough to cover `target_count + 1` varuint32 targets after the count.
+            target_count = 0
+            for i, b in enumerate(buf[1:1 + MAX_VARUINT32_SIZE]):
+                target_count |= (b & 0x7F) << (7 * i)
+                if not b & 0x80:
+                    break
+            size = min(1 + MAX_VARUINT32_SIZE * (target_count + 2), MAX_BR_TABLE_SIZE)
+            seg = ida_segment.getseg(addr)
+            if seg:
+                size = min(size, seg.end_ea - addr)
+            buf = ida_bytes.get_bytes(addr, size)
 
-        raise RuntimeError('could not decode bytecode')
+        try:
+            return next(wasm.decode_bytecode(buf))
+        except Exception as e:
+            raise RuntimeError('could not decode bytecode') from e
+
+    def ana_imm_BlockImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # block, loop, if
+        # sig = BlockTypeField()
+        op1 = insn.Op1
+        op1.type = WASM_BLOCK
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.sig
+        op1.specval = WASM_BLOCK
+
+    def ana_imm_BranchImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # br, br_if
+        # relative_depth = VarUInt32Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.relative_depth
+
+    def ana_imm_BranchTableImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # br_table
+        # target_count = VarUInt32Field()
+        # target_table = RepeatField(VarUInt32Field(), lambda x: x.target_count)
+        # default_target = VarUInt32Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.target_count
+
+        op2 = insn.Op2
+        op2.type = ida_ua.o_imm
+        op2.flags = SHOW_FLAGS
+        op2.dtype = ida_ua.dt_dword
+        # save instruction address for rendering branch table
+        op2.addr = insn.ea
+        op2.specval = WASM_BRANCH_TABLE
+
+        op3 = insn.Op3
+        op3.type = ida_ua.o_imm
+        op3.flags = SHOW_FLAGS
+        op3.dtype = ida_ua.dt_dword
+        op3.value = imm.default_target
+        op3.specval = WASM_BRANCH_TABLE_DEFAULT
+
+    def ana_imm_CallImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # call
+        # function_index = VarUInt32Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.function_index
+        op1.specval = WASM_FUNC_INDEX
+
+    def ana_imm_CallIndirectImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # call_indirect
+        # type_index = VarUInt32Field()
+        # reserved = VarUInt1Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.type_index
+        op1.specval = WASM_TYPE_INDEX
+
+        op2 = insn.Op2
+        op2.type = ida_ua.o_imm
+        op2.flags = SHOW_FLAGS
+        op2.dtype = ida_ua.dt_dword
+        op2.value = imm.reserved
+
+    def ana_imm_LocalVarXsImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # get_local, set_local, tee_local
+        # local_index = VarUInt32Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_reg
+        op1.reg = imm.local_index
+        op1.specval = WASM_LOCAL
+
+    def ana_imm_GlobalVarXsImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # get_global, set_global
+        # global_index = VarUInt32Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.global_index
+        op1.specval = WASM_GLOBAL
+
+    def ana_imm_MemoryImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # *.load*, *.store*
+        # flags = VarUInt32Field()
+        # offset = VarUInt32Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.offset
+
+        op2 = insn.Op2
+        op2.type = ida_ua.o_imm
+        op2.flags = SHOW_FLAGS
+        op2.dtype = ida_ua.dt_dword
+        op2.value = imm.flags
+        op2.specval = WASM_ALIGN
+
+    def ana_imm_CurGrowMemImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # current_memory, grow_memory
+        # reserved = VarUInt1Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.reserved
+
+    def ana_imm_I32ConstImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # i32.const
+        # value = VarInt32Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_dword
+        op1.value = imm.value
+
+    def ana_imm_I64ConstImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # i64.const
+        # value = VarInt64Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_qword
+        op1.value = imm.value
+
+    def ana_imm_F32ConstImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # f32.const
+        # value = UInt32Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_float
+        op1.value = imm.value
+
+    def ana_imm_F64ConstImm(self, insn: ida_ua.insn_t, imm) -> None:
+        # f64.const
+        # value = UInt64Field()
+        op1 = insn.Op1
+        op1.type = ida_ua.o_imm
+        op1.dtype = ida_ua.dt_double
+        op1.value = imm.value
 
     @ida_entry_point
     def ev_ana_insn(self, insn: ida_ua.insn_t) -> int:
@@ -1346,24 +1665,22 @@ class wasm_processor_t(ida_idp.processor_t):
         # as of today (v1), each opcode is a single byte
         opb = insn.get_next_byte()
 
-        if opb not in wasm.opcodes.OPCODE_MAP:
-            return 0
-
         # translate from opcode index to IDA-specific const.
         # as you can see elsewhere, IDA insn consts have to be contiguous,
         #  so we can't just re-use the opcode index.
-        insn.itype = self.insns[opb]['id']
-
-        # fetch entire instruction buffer to decode
-        if wasm.opcodes.OPCODE_MAP.get(opb).imm_struct:
-            # opcode has operands that we must decode
+        itype = self.opcode_itypes[opb]
+        if itype is None:
+            return 0
+        insn.itype = itype
 
-            bc = self._decode_bytecode_at(insn.ea)
-        else:
-            # single byte instruction
+        if not self.opcode_has_imm[opb]:
+            # single byte instruction, with no operands.
+            # IDA clears the insn before analysis, so the operands are already o_void.
+            return insn.size
 
-            buf = bytes([opb])
-            bc = next(wasm.decode_bytecode(buf))
+        # opcode has operands that we must decode,
+        # so fetch entire instruction buffer to decode
+        bc = self._decode_bytecode_at(insn.ea)
 
         for _ in range(1, bc.len):
             # consume any additional bytes.
@@ -1387,143 +1704,24 @@ class wasm_processor_t(ida_idp.processor_t):
         #   WASM_ALIGN
         #
         if bc.imm is not None:
-            immtype = bc.imm.get_meta().structure
-
-            SHOW_FLAGS = ida_ua.OF_NO_BASE_DISP | ida_ua.OF_NUMBER | ida_ua.OF_SHOW
-
-            # by default, display the operand, unless overridden below.
+            # by default, display the operand, unless overridden by the handler.
             insn.Op1.flags = SHOW_FLAGS
 
-            # block, loop, if
-            if immtype == wasm.immtypes.BlockImm:
-                # sig = BlockTypeField()
-                insn.Op1.type = WASM_BLOCK
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.sig
-                insn.Op1.specval = WASM_BLOCK
-
-            # br, br_if
-            elif immtype == wasm.immtypes.BranchImm:
-                # relative_depth = VarUInt32Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.relative_depth
-
-            # br_table
-            elif immtype == wasm.immtypes.BranchTableImm:
-                # target_count = VarUInt32Field()
-                # target_table = RepeatField(VarUInt32Field(), lambda x: x.target_count)
-                # default_target = VarUInt32Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.target_count
-
-                insn.Op2.type = ida_ua.o_imm
-                insn.Op2.flags = SHOW_FLAGS
-                insn.Op2.dtype = ida_ua.dt_dword
-                # save instruction address for rendering branch table
-                insn.Op2.addr = insn.ea
-                insn.Op2.specval = WASM_BRANCH_TABLE
-
-                insn.Op3.type = ida_ua.o_imm
-                insn.Op3.flags = SHOW_FLAGS
-                insn.Op3.dtype = ida_ua.dt_dword
-                insn.Op3.value = bc.imm.default_target
-                insn.Op3.specval = WASM_BRANCH_TABLE_DEFAULT
-
-            # call
-            elif immtype == wasm.immtypes.CallImm:
-                # function_index = VarUInt32Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.function_index
-                insn.Op1.specval = WASM_FUNC_INDEX
-
-            # call_indirect
-            elif immtype == wasm.immtypes.CallIndirectImm:
-                # type_index = VarUInt32Field()
-                # reserved = VarUInt1Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.type_index
-                insn.Op1.specval = WASM_TYPE_INDEX
-
-                insn.Op2.type = ida_ua.o_imm
-                insn.Op2.flags = SHOW_FLAGS
-                insn.Op2.dtype = ida_ua.dt_dword
-                insn.Op2.value = bc.imm.reserved
-
-            # get_local, set_local, tee_local
-            elif immtype == wasm.immtypes.LocalVarXsImm:
-                # local_index = VarUInt32Field()
-                insn.Op1.type = ida_ua.o_reg
-                insn.Op1.reg = bc.imm.local_index
-                insn.Op1.specval = WASM_LOCAL
-
-            # get_global, set_global
-            elif immtype == wasm.immtypes.GlobalVarXsImm:
-                # global_index = VarUInt32Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.global_index
-                insn.Op1.specval = WASM_GLOBAL
-
-            # *.load*, *.store*
-            elif immtype == wasm.immtypes.MemoryImm:
-                # flags = VarUInt32Field()
-                # offset = VarUInt32Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.offset
-
-                insn.Op2.type = ida_ua.o_imm
-                insn.Op2.flags = SHOW_FLAGS
-                insn.Op2.dtype = ida_ua.dt_dword
-                insn.Op2.value = bc.imm.flags
-                insn.Op2.specval = WASM_ALIGN
-
-            # current_memory, grow_memory
-            elif immtype == wasm.immtypes.CurGrowMemImm:
-                # reserved = VarUInt1Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.reserved
-
-            # i32.const
-            elif immtype == wasm.immtypes.I32ConstImm:
-                # value = VarInt32Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_dword
-                insn.Op1.value = bc.imm.value
-
-            # i64.const
-            elif immtype == wasm.immtypes.I64ConstImm:
-                # value = VarInt64Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_qword
-                insn.Op1.value = bc.imm.value
-
-            # f32.const
-            elif immtype == wasm.immtypes.F32ConstImm:
-                # value = UInt32Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_float
-                insn.Op1.value = bc.imm.value
-
-            # f64.const
-            elif immtype == wasm.immtypes.F64ConstImm:
-                # value = UInt64Field()
-                insn.Op1.type = ida_ua.o_imm
-                insn.Op1.dtype = ida_ua.dt_double
-                insn.Op1.value = bc.imm.value
+            # see `init_ana_handlers`.
+            handler = self.ana_handlers.get(type(bc.imm))
+            if handler is not None:
+                handler(insn, bc.imm)
 
         return insn.size
 
     def init_instructions(self):
         # Now create an instruction table compatible with IDA processor module requirements
-        self.insns = {}
+        # Array of instructions
+        # the index into this array apparently must match the `self.itype_*`,
+        #  so it is filled in the order of `OPCODES`, which is also the itype order.
+        self.instruc = []
         for i, op in enumerate(wasm.opcodes.OPCODES):
-            self.insns[op.id] = {
+            self.instruc.append({
                 # the opcode byte
                 'opcode': op.id,
                 # the IDA constant for this instruction
@@ -1531,53 +1729,163 @@ class wasm_processor_t(ida_idp.processor_t):
                 'name': op.mnemonic,
                 'feature': op.flags,
                 'cmt': idawasm.const.WASM_OPCODE_DESCRIPTIONS.get(op.id),
-            }
+            })
+
             clean_mnem = op.mnemonic.replace('.', '_').replace('/', '_').upper()
             # the itype constant value must be contiguous, which sucks, because its not the op.id value.
             setattr(self, 'itype_' + clean_mnem, i)
 
-        # Array of instructions
-        # the index into this array apparently must match the `self.itype_*`.
-        self.instruc = list(sorted(self.insns.values(), key=lambda i: i['id']))
+        # flat tables indexed by opcode byte, used by `ev_ana_insn`.
+        # itype of each opcode, or None for invalid opcodes.
+        self.opcode_itypes = [None] * 0x100
+        # non-zero for opcodes that have an immediate.
+        self.opcode_has_imm = bytearray(0x100)
+        for i, op in enumerate(wasm.opcodes.OPCODES):
+            self.opcode_itypes[op.id] = i
+            self.opcode_has_imm[op.id] = op.imm_struct is not None
+
+        # instructions that never flow to the following instruction.
+        # equivalent to `insn.get_canon_feature() & wasm.INSN_NO_FLOW`, without the call into IDA.
+        self.noflow_itypes = frozenset(i for i, ins in enumerate(self.instruc) if ins['feature'] & wasm.INSN_NO_FLOW)
+
+        # instructions whose first operand may be the address of data: i32.const, and the offset of loads and stores.
+        # note: `imm_struct` is an instance of the immediate structure, not the class.
+        self.data_ref_itypes = frozenset(i for i, op in enumerate(wasm.opcodes.OPCODES)
+                                         if isinstance(op.imm_struct, (wasm.immtypes.I32ConstImm,
+                                                                       wasm.immtypes.MemoryImm)))
+
+        # instructions that are annotated with the name of the block they open or close.
+        self.block_itypes = frozenset({self.itype_BLOCK, self.itype_LOOP, self.itype_IF, self.itype_END})
+
+        # number of operands filled in by `ev_ana_insn`, indexed by itype.
+        # most immediates are a single operand, except those that also place operands into Op2+.
+        # note: `imm_struct` is an instance of the immediate structure, so match on its type.
+        operand_counts = {
+            wasm.immtypes.BranchTableImm: 3,
+            wasm.immtypes.CallIndirectImm: 2,
+            wasm.immtypes.MemoryImm: 2,
+        }
+        self.insn_operand_counts = tuple(0 if op.imm_struct is None else operand_counts.get(type(op.imm_struct), 1)
+                                         for op in wasm.opcodes.OPCODES)
+
+        # auto-comment for each instruction, indexed by itype.
+        self.insn_cmts = tuple(i['cmt'] for i in self.instruc)
 
         self.instruc_start = 0
         self.instruc_end = len(self.instruc)
         self.icode_return = self.itype_RETURN
 
+    def init_ana_handlers(self):
+        """
+        build the table of handlers that decode instruction immediates into operands, see `ev_ana_insn`.
+        the table maps from immediate type to the `ana_imm_*` handler of the same name.
+
+        decoded immediates are instances of a data class generated for each immediate structure,
+         so the table is keyed by that class, and `type(bc.imm)` can be looked up directly.
+        """
+        self.ana_handlers = {}
+        for immtype in (wasm.immtypes.BlockImm,
+                        wasm.immtypes.BranchImm,
+                        wasm.immtypes.BranchTableImm,
+                        wasm.immtypes.CallImm,
+                        wasm.immtypes.CallIndirectImm,
+                        wasm.immtypes.LocalVarXsImm,
+                        wasm.immtypes.GlobalVarXsImm,
+                        wasm.immtypes.MemoryImm,
+                        wasm.immtypes.CurGrowMemImm,
+                        wasm.immtypes.I32ConstImm,
+                        wasm.immtypes.I64ConstImm,
+                        wasm.immtypes.F32ConstImm,
+                        wasm.immtypes.F64ConstImm):
+            self.ana_handlers[immtype._meta.data_class] = getattr(self, 'ana_imm_' + immtype.__name__)
+
+    def init_emu_handlers(self):
+        """
+        build the tables of emulation handlers for control flow instructions, indexed by itype.
+        `emu_end_handlers` handle instructions immediately followed by an END, see `ev_emu_insn`.
+        `emu_handlers` handle the remaining cases.
+        instructions without a handler simply flow to the next instruction.
+        """
+        end_handlers = [None] * len(self.instruc)
+
+        # handle cases like:
+        #
+        #     block
+        #     ...
+        #     br $foo
+        #     end
+        #
+        # we want the cref to flow from the instruction `end`, not `br $foo`.
+        end_handlers[self.itype_BR] = self.notify_emu_BR_END
+        end_handlers[self.itype_BR_IF] = self.notify_emu_BR_IF_END
+        end_handlers[self.itype_BR_TABLE] = self.notify_emu_BR_TABLE_END
+
+        # handle cases like:
+        #
+        #     ...
+        #     return
+        #     end
+        #
+        # we want return to flow into the return, which should then not flow.
+        end_handlers[self.itype_RETURN] = self.notify_emu_RETURN_END
+
+        # handle cases like:
+        #
+        #     ...
+        #     unreachable
+        #     end
+        end_handlers[self.itype_UNREACHABLE] = self.notify_emu_UNREACHABLE_END
+
+        self.emu_end_handlers = tuple(end_handlers)
+
+        # instructions whose emulation depends on the following instruction.
+        # this includes BR, which is also handled specially when followed by UNREACHABLE.
+        self.peek_itypes = frozenset(itype for itype, handler in enumerate(end_handlers) if handler is not None)
+
+        handlers = [None] * len(self.instruc)
+
+        # an unconditional branch not at the end of a block.
+        handlers[self.itype_BR] = self.notify_emu_BR
+        handlers[self.itype_BR_TABLE] = self.notify_emu_BR_TABLE
+        # a conditional branch not at the end of a block.
+        handlers[self.itype_BR_IF] = self.notify_emu_BR_IF
+        handlers[self.itype_IF] = self.notify_emu_IF
+        handlers[self.itype_ELSE] = self.notify_emu_ELSE
+        # add flows deferred from a prior branch, eg.
+        #
+        #     br $foo
+        #     end
+        #
+        # flows deferred from the BR to the END insn.
+        handlers[self.itype_END] = self.notify_emu_END
+
+        self.emu_handlers = tuple(handlers)
+
     def init_registers(self):
         """This function parses the register table and creates corresponding ireg_XXX constants"""
 
         # Registers definition
         # for wasm, "registers" are local variables.
-        self.reg_names = []
 
-        # we'd want to scan the module and pick the max number of parameters,
-        # however, the data isn't available yet,
+        # we'd want to scan the module and pick the max number of locals and parameters,
+        # however, the data isn't available yet (and the register table is fixed once the processor is created),
         # so we pick a scary large number.
         #
         # note: IDA reg_t size is 16-bits
         MAX_LOCALS = 0x1000
-        for i in range(MAX_LOCALS):
-            self.reg_names.append("$local%d" % (i))
-
-        # we'd want to scan the module and pick the max number of parameters,
-        # however, the data isn't available yet,
-        # so we pick a scary large number.
         MAX_PARAMS = 0x1000
-        for i in range(MAX_PARAMS):
-            self.reg_names.append("$param%d" % (i))
+
+        self.reg_names = [f'$local{i}' for i in range(MAX_LOCALS)] + [f'$param{i}' for i in range(MAX_PARAMS)]
 
         # these are fake, "virtual" registers.
         # req'd for IDA, apparently.
         # (not actually used in wasm)
-        self.reg_names.append("SP")
-        self.reg_names.append("CS")
-        self.reg_names.append("DS")
+        self.reg_names += ["SP", "CS", "DS"]
 
         # Create the ireg_XXXX constants.
         # for wasm, will look like: ireg_LOCAL0, ireg_PARAM0
-        for i in range(len(self.reg_names)):
-            setattr(self, 'ireg_' + self.reg_names[i].replace('$', ''), i)
+        for i, reg_name in enumerate(self.reg_names):
+            setattr(self, 'ireg_' + reg_name.replace('$', ''), i)
 
         # Segment register information (use virtual CS and DS registers if your
         # processor doesn't have segment registers):
@@ -1599,34 +1907,64 @@ class wasm_processor_t(ida_idp.processor_t):
         self.PTRSZ = 4  # Assume PTRSZ = 4 by default
         self.init_instructions()
         self.init_registers()
+        self.init_emu_handlers()
+        self.init_ana_handlers()
 
         # these will be populated by `notify_newfile`
         self.buf = b''
         # ordered list of wasm section objects
         self.sections: list[ModuleFragment] = []
+        # map from section id to (section, file offset)
+        self.section_index: dict[int, tuple[ModuleFragment, int]] = {}
         # map from function index to function object
         self.functions: dict[int, Function] = {}
         # map from virtual address to function object
         self.function_offsets = {}
-        # map from (va-start, va-end) to function object
-        self.function_ranges = {}
+        # function objects sorted by va, and their (va-start, va-end) in parallel arrays
+        self.sorted_functions: list[Function] = []
+        self.function_starts = array.array('Q')
+        self.function_ends = array.array('Q')
+        # (va-start, va-end, function object) of the most recent `_get_function` result
+        self.last_function: Optional[tuple[int, int, Function]] = None
         # map from global index to global object
         self.globals: dict[int, Global] = {}
         # map from data index to data object
         self.data: dict[int, Data] = {}
+        # (va-start, va-end, ea) of data objects sorted by va, in parallel arrays
+        self.data_starts = array.array('q')
+        self.data_ends = array.array('q')
+        self.data_eas = array.array('Q')
+        # maximum va-end of the data objects up to each index of the sorted data objects
+        self.data_max_ends = array.array('q')
+        # map from function offset to decoded instructions
+        self.decoded_bodies: dict[int, list[Instruction]] = {}
+        # map from va to decoded instruction
+        self.decoded_insns: dict[int, Instruction] = {}
         # map from va to map from relative depth to va
         self.branch_targets: dict[int, dict[str, Block]] = {}
+        # map from branch va to target vas
+        self.branch_edges: dict[int, tuple[int, ...]] = {}
         # list of type descriptors
         self.types = []
 
+        # map from va to (function object, block label) rendered by `ev_out_insn`
+        self.line_annotations: dict[int, tuple[Optional[Function], Optional[str]]] = {}
+
+        # caches of rendered text, used by `ev_out_insn` and `ev_out_operand`.
+        # map from function index to rendered function prototype
+        self.rendered_prototypes: dict[int, str] = {}
+        # map from type index to rendered type signature
+        self.rendered_types: dict[int, str] = {}
+        # map from br_table va to rendered branch table
+        self.rendered_branch_tables: dict[int, str] = {}
+
         # map from address to list of cref arguments.
         # used by `notify_emu`.
         self.deferred_flows = {}
 
         # set of addresses which should not flow.
-        # map from address to True.
         # used by `notify_emu`.
-        self.deferred_noflows = {}
+        self.deferred_noflows: set[int] = set()
 
 
 def PROCESSOR_ENTRY():
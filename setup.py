@@ -14,4 +14,9 @@ setuptools.setup(
         'wasm',
         'ida-netnode',
     ],
+    entry_points={
+        'console_scripts': [
+            'idawasm=idawasm.cli:main',
+        ],
+    },
 )